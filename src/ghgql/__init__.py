@@ -5,3 +5,12 @@ from importlib.metadata import version
 __version__ = version("ghgql")
 
 from .ghgql import GithubGraphQL
+from ._util import dotted_get
+
+
+def __getattr__(name):
+    # AsyncGithubGraphQL needs the optional httpx, so import it on first use.
+    if name == "AsyncGithubGraphQL":
+        from .aio import AsyncGithubGraphQL # pylint: disable=import-outside-toplevel
+        return AsyncGithubGraphQL
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
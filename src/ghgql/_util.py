@@ -0,0 +1,44 @@
+"""
+ghgql._util
+~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+This provides helpers to inspect the results of queries.
+"""
+
+
+import functools
+import re
+from typing import Any, Tuple, Union
+
+_KEY_RE = re.compile(r"[^.\[\]]+")
+
+
+@functools.lru_cache(maxsize=1024)
+def _split_path(path: str) -> Tuple[Union[str, int], ...]:
+    """ Splits `path` (e.g. "errors[0].message") into its keys and list indices. """
+    return tuple(int(key) if key.isdigit() else key for key in _KEY_RE.findall(path))
+
+
+def dotted_get(obj: Any, path: str, default: Any = None) -> Any:
+    """
+    Returns the value at `path` in the nested dicts and lists `obj`, e.g. the
+    result of a query:
+
+        dotted_get(result, "data.viewer.login")
+        dotted_get(result, "errors[0].message")
+
+    Args:
+        obj (dict): The object to look into.
+        path (str): Dict keys separated by dots, and list indices either in
+            brackets or separated by dots, too.
+        default: The value to return if `path` doesn't exist in `obj`.
+
+    Returns:
+        The value at `path` or `default`.
+    """
+    try:
+        for key in _split_path(path):
+            obj = obj[key]
+    except (KeyError, IndexError, TypeError):
+        return default
+    return obj
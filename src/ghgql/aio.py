@@ -0,0 +1,185 @@
+"""
+ghgql.aio
+~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+This provides an asynchronous class that can be used to query the Github
+GraphQL API with many queries in flight at the same time. It requires the
+`async` extra: `pip install "ghgql[async]"`
+"""
+
+
+import asyncio
+from typing import Dict, Iterable, List, Tuple, Union, Any
+from .batch import merge_queries, split_result
+from .ghgql import _GithubGraphQLBase, _dumps, _loads
+
+try:
+    import httpx
+except ImportError as import_error:
+    raise ImportError('AsyncGithubGraphQL requires httpx, install "ghgql[async]"') from import_error
+
+
+class AsyncGithubGraphQL(_GithubGraphQLBase):
+    """ A lightweight asynchronous Github GraphQL API client.
+
+    All queries share one HTTP/2 capable connection pool, so running them
+    concurrently costs roughly one round-trip instead of one per query.
+
+    In order to properly close the client, use this class as an async context
+    manager:
+
+        async with AsyncGithubGraphQL(token="<GITHUB_API_TOKEN>") as g:
+            results = await g.query_many([(query1, None), (query2, {"org": "kwk-org"})])
+
+    or await the close() method manually
+
+        g = AsyncGithubGraphQL(token="<GITHUB_API_TOKEN>")
+        await g.close()
+    """
+
+    def __init__(
+            self,
+            token: str = "",
+            endpoint: str = "https://api.github.com/graphql",
+            **kwargs):
+        """
+        Creates a client with the given bearer `token` and `endpoint`.
+
+        Args:
+            token (str): Your personal access token in Github (see https://github.com/settings/tokens)
+            endpoint (str): The endpoint to query GraphQL from
+            **kwargs: key-value pairs (e.g. {raise_on_error=True, timeout=(10, 60)})
+        """
+        super().__init__(token, endpoint, **kwargs)
+        if isinstance(self.timeout, tuple):
+            timeout = httpx.Timeout(self.timeout[1], connect=self.timeout[0])
+        else:
+            timeout = httpx.Timeout(self.timeout)
+        self.__client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=64),
+            timeout=timeout,
+            headers=self._headers())
+
+    async def query_from_file(self,
+                              filename: str,
+                              variables: Dict[str,
+                                              Union[str,
+                                                    int]] = None,
+                              **kwargs) -> Any:
+        """
+        Read the query from the given file and execute it with the variables
+        applied. See `query()` for details.
+
+        Args:
+            filename (str): The filename of the query file.
+            variables (dict): The variables to be applied to the query.
+            **kwargs: key-value pairs (e.g. {raise_on_error=True})
+        """
+        return await self.query(self._read_query_file(filename), variables, **kwargs)
+
+    async def __aenter__(self):
+        return self
+
+    @property
+    def session_headers(self) -> httpx.Headers:
+        """ Returns the HTTP headers used for the client. """
+        return self.__client.headers
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """ Closes the client and its connections. """
+        await self.__client.aclose()
+
+    async def query(self,
+                    query: str,
+                    variables: Dict[str,
+                                    Union[str,
+                                          int]] = None,
+                    **kwargs) -> Dict:
+        """
+        Execute the query with the variables applied. If not requested otherwise
+        the plain result is returned. If you want to raise an exception in case
+        of an error you can set `raise_on_error` to `True`.
+
+        Args:
+            query (str): The GraphQL query.
+            variables (dict): The variables to be applied to the query.
+            **kwargs: key-value pairs (e.g. {raise_on_error=True})
+
+        Raises:
+            RuntimeError: In case of an error when `raise` is `True`.
+            JSONDecodeError: If the response is not a JSON document.
+
+        Returns:
+            dict: The result of the query. Inspect the result for errors!
+        """
+        req = await self.__client.post(
+            url=self.endpoint,
+            content=_dumps({"query": query, "variables": variables}))
+        req.raise_for_status()
+        res = _loads(req.content)
+        self._check_result(res, **kwargs)
+        return res
+
+    async def query_many(self,
+                         queries: Iterable[Tuple[str,
+                                                 Dict[str,
+                                                      Union[str,
+                                                            int]]]],
+                         **kwargs) -> List[Dict]:
+        """
+        Execute all `(query, variables)` pairs concurrently and return their
+        results in the same order. The first exception raised by any of the
+        queries is propagated.
+
+        Args:
+            queries (iterable): The `(query, variables)` pairs to execute.
+            **kwargs: key-value pairs (e.g. {raise_on_error=True})
+
+        Returns:
+            list: The results of the queries.
+        """
+        return list(await asyncio.gather(
+            *(self.query(query, variables, **kwargs) for query, variables in queries)))
+
+    async def query_batch(self,
+                          queries: Iterable[Tuple[str,
+                                                  Dict[str,
+                                                       Union[str,
+                                                             int]]]],
+                          **kwargs) -> List[Dict]:
+        """
+        Execute all `(query, variables)` pairs with as few requests as possible
+        and return their results in the same order. Up to `batch_size` queries
+        (10 by default) are merged into a single request (see `ghgql.batch`)
+        and the requests run concurrently.
+
+        Mind that a query which fails to validate makes every other query in
+        the same request fail, too.
+
+        Args:
+            queries (iterable): The `(query, variables)` pairs to execute.
+            **kwargs: key-value pairs (e.g. {raise_on_error=True, batch_size=10})
+
+        Raises:
+            ValueError: If a query cannot be merged with others.
+            RuntimeError: In case of an error when `raise` is `True`.
+
+        Returns:
+            list: The results of the queries. Inspect the results for errors!
+        """
+        queries = list(queries)
+        batch_size = kwargs.pop('batch_size', 10)
+        batches = [queries[start:start + batch_size] for start in range(0, len(queries), batch_size)]
+        merged = [merge_queries(batch) for batch in batches]
+        responses = await self.query_many(((query, variables) for query, variables, _ in merged),
+                                          raise_on_error=False)
+        results: List[Dict] = []
+        for batch, (_, _, aliases), res in zip(batches, merged, responses):
+            results += split_result(res, aliases, len(batch))
+        for res in results:
+            self._check_result(res, **kwargs)
+        return results
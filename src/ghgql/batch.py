@@ -0,0 +1,242 @@
+"""
+ghgql.batch
+~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+This provides functions to send several GraphQL queries in one request and to
+split the combined result back into one result per query.
+
+Every query is rewritten so that it cannot clash with the others: its
+top-level fields are aliased, and its variables and fragments are renamed,
+all with the prefix `q<index>_`. For example the two queries
+
+    query { viewer { login } }
+    query($org: String!) { organization(login: $org) { name } }
+
+are merged into
+
+    query($q1_org: String!) {
+        q0_viewer: viewer { login }
+        q1_organization: organization(login: $q1_org) { name }
+    }
+"""
+
+
+import re
+from typing import Dict, List, Optional, Tuple, Union
+
+_TOKEN_RE = re.compile(r'''
+      (?P<ignored>[\s,\ufeff]+|\#[^\n\r]*)
+    | (?P<token>
+          """(?:\\"""|[^"]|"(?!""))*"""
+        | "(?:\\.|[^"\\\n\r])*"
+        | \.\.\.
+        | \$[_A-Za-z][_0-9A-Za-z]*
+        | [!&()\:=@\[\]{|}]
+        | [_A-Za-z][_0-9A-Za-z]*
+        | -?[0-9]+(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?
+      )
+''', re.VERBOSE)
+
+_NAME_RE = re.compile(r"[_A-Za-z][_0-9A-Za-z]*")
+
+_OPENING = {"(": ")", "[": "]", "{": "}"}
+
+# Maps the alias of a top-level field in the merged query to the index of the
+# query it came from and the field's key in that query's result.
+Aliases = Dict[str, Tuple[int, str]]
+
+
+def _tokenize(query: str) -> List[str]:
+    """ Splits the GraphQL document `query` into tokens, dropping comments and whitespace. """
+    tokens = []
+    pos = 0
+    while pos < len(query):
+        if (match := _TOKEN_RE.match(query, pos)) is None:
+            raise ValueError(f"unexpected character {query[pos]!r} at position {pos}")
+        if match.group("token") is not None:
+            tokens.append(match.group("token"))
+        pos = match.end()
+    return tokens
+
+
+def _closing(tokens: List[str], start: int) -> int:
+    """ Returns the index of the bracket that closes the one at `start`. """
+    depth = 0
+    for i in range(start, len(tokens)):
+        if tokens[i] in _OPENING:
+            depth += 1
+        elif tokens[i] in _OPENING.values():
+            depth -= 1
+            if depth == 0:
+                return i
+    raise ValueError(f"unbalanced {tokens[start]!r}")
+
+
+def _rename(tokens: List[str], prefix: str) -> List[str]:
+    """ Prefixes all variable and fragment names in `tokens` with `prefix`. """
+    renamed = []
+    depth = 0
+    for i, token in enumerate(tokens):
+        previous = tokens[i - 1] if i > 0 else None
+        if token.startswith("$"):
+            token = "$" + prefix + token[1:]
+        elif token in _OPENING:
+            depth += 1
+        elif token in _OPENING.values():
+            depth -= 1
+        elif _NAME_RE.fullmatch(token) and (previous == "..." and token != "on"
+                                            or previous == "fragment" and depth == 0):
+            token = prefix + token
+        renamed.append(token)
+    return renamed
+
+
+def _alias(selections: List[str], prefix: str, index: int, aliases: Aliases) -> List[str]:
+    """
+    Returns the top-level `selections` of a query with every field aliased
+    by `prefix` and records the aliases in `aliases`.
+    """
+    aliased = []
+    i = 0
+    while i < len(selections):
+        if selections[i] == "...":
+            # Fields in an inline fragment on the query type are top-level fields, too.
+            start = i + 1
+            while selections[start] != "{":
+                if selections[start] not in {"on", "@", "("} and selections[start - 1] == "...":
+                    raise ValueError("fragment spreads are not supported at the top level")
+                start = _closing(selections, start) + 1 if selections[start] == "(" else start + 1
+            end = _closing(selections, start)
+            aliased += selections[i:start + 1]
+            aliased += _alias(selections[start + 1:end], prefix, index, aliases)
+            aliased.append("}")
+            i = end + 1
+            continue
+        key = selections[i]
+        name = i + 2 if i + 1 < len(selections) and selections[i + 1] == ":" else i
+        end = name + 1
+        while end < len(selections) and selections[end] in {"(", "@", "{"}:
+            if selections[end] == "@":
+                end += 2
+            else:
+                end = _closing(selections, end) + 1
+        aliases[prefix + key] = (index, key)
+        aliased += [prefix + key, ":"] + selections[name:end]
+        i = end
+    return aliased
+
+
+def _split_document(tokens: List[str]) -> Tuple[List[str], List[str], List[str]]:
+    """
+    Returns the variable definitions, the top-level selections and the fragment
+    definitions of the document in `tokens`.
+    """
+    definitions: List[str] = []
+    selections: List[str] = []
+    fragments: List[str] = []
+    operations = 0
+    i = 0
+    while i < len(tokens):
+        if tokens[i] == "fragment":
+            end = _closing(tokens, tokens.index("{", i))
+            fragments += tokens[i:end + 1]
+            i = end + 1
+            continue
+        if tokens[i] in {"mutation", "subscription"}:
+            raise ValueError(f"only queries can be batched, not a {tokens[i]}")
+        operations += 1
+        if tokens[i] == "query":
+            i += 1
+            if _NAME_RE.fullmatch(tokens[i]):
+                i += 1  # Skip the operation name
+            if tokens[i] == "(":
+                end = _closing(tokens, i)
+                definitions += tokens[i + 1:end]
+                i = end + 1
+        if tokens[i] != "{":
+            raise ValueError(f"unexpected {tokens[i]!r}")
+        end = _closing(tokens, i)
+        selections += tokens[i + 1:end]
+        i = end + 1
+    if operations != 1:
+        raise ValueError(f"expected exactly one operation, got {operations}")
+    return definitions, selections, fragments
+
+
+def merge_queries(queries: List[Tuple[str,
+                                      Optional[Dict[str,
+                                                    Union[str,
+                                                          int]]]]]) -> Tuple[str, Dict, Aliases]:
+    """
+    Merges the `(query, variables)` pairs into a single query.
+
+    Args:
+        queries (list): The `(query, variables)` pairs to merge. Every query
+            must be a document with exactly one query operation.
+
+    Raises:
+        ValueError: If a query cannot be merged.
+
+    Returns:
+        tuple: The merged query, its variables and the aliases needed by
+            `split_result()`.
+    """
+    definitions: List[str] = []
+    selections: List[str] = []
+    fragments: List[str] = []
+    variables = {}
+    aliases: Aliases = {}
+    for index, (query, query_variables) in enumerate(queries):
+        prefix = f"q{index}_"
+        try:
+            document = _split_document(_rename(_tokenize(query), prefix))
+            definitions += document[0]
+            selections += _alias(document[1], prefix, index, aliases)
+            fragments += document[2]
+        except IndexError as ex:
+            raise ValueError(f"Unexpected end of query {index}") from ex
+        except ValueError as ex:
+            raise ValueError(f"Cannot batch query {index}: {ex}") from ex
+        for name, value in (query_variables or {}).items():
+            variables[prefix + name] = value
+
+    merged = ["query"]
+    if definitions:
+        merged += ["("] + definitions + [")"]
+    merged += ["{"] + selections + ["}"] + fragments
+    return " ".join(merged), variables, aliases
+
+
+def split_result(res: Dict, aliases: Aliases, count: int) -> List[Dict]:
+    """
+    Splits the result of a query merged by `merge_queries()` into the results
+    of the `count` original queries.
+
+    Errors that belong to a field of one query are only added to the result of
+    that query. All other errors (e.g. syntax errors) are added to all results.
+
+    Args:
+        res (dict): The result of the merged query.
+        aliases (dict): The aliases returned by `merge_queries()`.
+        count (int): The number of merged queries.
+
+    Returns:
+        list: One result per original query.
+    """
+    results: List[Dict] = [{} for _ in range(count)]
+    if "data" in res:
+        data = res["data"]
+        for result in results:
+            result["data"] = None if data is None else {}
+        for alias, value in (data or {}).items():
+            index, key = aliases[alias]
+            results[index]["data"][key] = value
+    for error in res.get("errors") or []:
+        path = error.get("path") if isinstance(error, dict) else None
+        if path and path[0] in aliases:
+            index, key = aliases[path[0]]
+            results[index].setdefault("errors", []).append(dict(error, path=[key] + path[1:]))
+        else:
+            for result in results:
+                result.setdefault("errors", []).append(error)
+    return results
@@ -6,13 +6,184 @@ This provides a simply class that can be used to query the Github GraphQL API.
 """
 
 
-from typing import Dict, Union, Any
-import fnc
-from requests import Session
+import functools
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union, Any
+from requests import JSONDecodeError, Session
+from requests.adapters import HTTPAdapter
 from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+from .batch import merge_queries, split_result
 
+try:
+    import orjson
+except ImportError:
+    orjson = None # pylint: disable=invalid-name
 
-class GithubGraphQL:
+try:
+    import ijson
+except ImportError:
+    ijson = None # pylint: disable=invalid-name
+
+# Matches documents that contain a mutation operation. Those are never cached
+# nor retried.
+_MUTATION_RE = re.compile(r"\bmutation\b")
+
+# Expired results are only dropped when they are looked up, so the cache is
+# capped at this many entries. The least recently stored go first.
+_CACHE_MAX_ENTRIES = 1024
+
+# HTTP headers that every client sends besides its Authorization header.
+_HEADERS = {
+    # See #
+    # https://github.blog/2021-11-16-graphql-global-id-migration-update/
+    'X-Github-Next-Global-ID': '1',
+    # The payload is serialized by ourselves, see _dumps().
+    "Content-Type": "application/json",
+}
+
+# Connection pools shared by all GithubGraphQL instances, keyed by the number
+# of retries. Keep-alive connections thus outlive the instance that opened them.
+_ADAPTERS: Dict[int, HTTPAdapter] = {}
+_ADAPTERS_LOCK = threading.Lock()
+
+
+def _check_finite(obj: Any):
+    """
+    Raises a ValueError if `obj` contains NaN or infinite floats, which orjson
+    would otherwise serialize as null.
+    """
+    if isinstance(obj, float):
+        if not math.isfinite(obj):
+            raise ValueError(f"Out of range float values are not JSON compliant: {obj!r}")
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            _check_finite(value)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            _check_finite(value)
+
+
+def _dumps(obj: Any) -> bytes:
+    """
+    Serializes `obj` to JSON, using orjson when it is installed. Either way,
+    NaN and infinite floats raise a ValueError.
+    """
+    if orjson is not None:
+        _check_finite(obj)
+        return orjson.dumps(obj)
+    return json.dumps(obj, allow_nan=False).encode("utf-8")
+
+
+def _loads(content: bytes) -> Any:
+    """
+    Deserializes the JSON document in `content`, using orjson when it is
+    installed. Raises the same `requests.JSONDecodeError` as requests'
+    Response.json() would if `content` is not a JSON document.
+    """
+    try:
+        if orjson is not None:
+            return orjson.loads(content)
+        return json.loads(content)
+    except json.JSONDecodeError as ex: # orjson's error derives from it, too
+        raise JSONDecodeError(ex.msg, ex.doc, ex.pos) from ex
+
+
+def _shared_adapter(retries: int) -> HTTPAdapter:
+    """
+    Returns the process-wide transport adapter that retries requests failing
+    with a transient error `retries` times. Requests that timed out while
+    waiting for the response are not retried, as they may have been processed.
+    """
+    with _ADAPTERS_LOCK:
+        if (adapter := _ADAPTERS.get(retries)) is None:
+            retry = Retry(
+                total=retries,
+                read=0,
+                status_forcelist=(429, 502, 503, 504),
+                allowed_methods=frozenset(["POST"]),
+                backoff_factor=0.5,
+                respect_retry_after_header=True,
+                # Hand the last response to raise_for_status() once we give up.
+                raise_on_status=False)
+            adapter = HTTPAdapter(max_retries=retry, pool_connections=16, pool_maxsize=64)
+            _ADAPTERS[retries] = adapter
+        return adapter
+
+
+@functools.lru_cache(maxsize=128)
+def _read_query(path: str, stat: Tuple[int, int], encoding: str) -> str: # pylint: disable=unused-argument
+    """
+    Returns the contents of the query file at `path`. The `stat` tuple holds
+    the file's modification time and size so that changed files are re-read.
+    """
+    with open(file=path, mode="r", encoding=encoding) as file_handle:
+        return file_handle.read()
+
+
+class _GithubGraphQLBase:
+    """ Holds what the synchronous and asynchronous clients have in common. """
+
+    def __init__(self, token: str, endpoint: str, **kwargs):
+        self.__endpoint = endpoint
+        self.__token = token
+        self.__encoding = "utf-8"
+        self.__raise_on_error = kwargs.get('raise_on_error', None)
+        self.__timeout = kwargs.get('timeout', (10.0, 60.0))
+
+    @property
+    def token(self) -> str:
+        """ Returns the bearer token. """
+        return self.__token
+
+    @property
+    def endpoint(self) -> str:
+        """ Returns the endpoint to query GraphQL from. """
+        return self.__endpoint
+
+    @property
+    def encoding(self) -> str:
+        """ Returns the default encoding to be expected from query files. """
+        return self.__encoding
+
+    @property
+    def timeout(self) -> Union[float, Tuple[float, float]]:
+        """
+        Returns the number of seconds to wait for the server, either as a single
+        value or as a `(connect, read)` tuple.
+        """
+        return self.__timeout
+
+    def _headers(self) -> Dict[str, str]:
+        """ Returns the HTTP headers to send along with every query. """
+        return {"Authorization": f"Bearer {self.__token}", **_HEADERS}
+
+    def _read_query_file(self, filename: str) -> str:
+        """ Returns the contents of the given query file. """
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        return _read_query(path, (stat.st_mtime_ns, stat.st_size), self.encoding)
+
+    def _check_result(self, res: Dict, **kwargs):
+        """
+        Raises an error if `res` contains GraphQL errors and `raise_on_error` is
+        requested in `kwargs` or, if not given there, in the constructor.
+        """
+        if "errors" in res and kwargs.get('raise_on_error', self.__raise_on_error):
+            errors = res["errors"]
+            message = "GraphQL Error"
+            if errors and isinstance(errors[0], dict):
+                message = errors[0].get("message", message)
+            raise RuntimeError(str(message))
+
+
+class GithubGraphQL(_GithubGraphQLBase):
     """ A lightweight Github GraphQL API client.
 
     In order to properly close the session, use this class as a context manager:
@@ -24,6 +195,21 @@ class GithubGraphQL:
 
         g = GithubGraphQL(token="<GITHUB_API_TOKEN>")
         g.close()
+
+    Connections are pooled process-wide, so creating many short-lived
+    instances reuses warm keep-alive connections instead of paying for a new
+    TCP and TLS handshake each time.
+
+    Requests that fail to connect or with a status code of 429, 502, 503 or
+    504 are retried up to 5 times with an exponential backoff (pass `retries=0`
+    to turn this off). Mutations are never retried.
+
+    Results of identical queries can be cached in-process for a number of
+    seconds by passing `cache_ttl`:
+
+        with GithubGraphQL(token="<GITHUB_API_TOKEN>", cache_ttl=60) as g:
+            g.query(query="query { viewer { login } }")
+            g.query(query="query { viewer { login } }") # served from cache
     """
 
     def __init__(
@@ -37,29 +223,30 @@ class GithubGraphQL:
         Args:
             token (str): Your personal access token in Github (see https://github.com/settings/tokens)
             endpoint (str): The endpoint to query GraphQL from
-            **kwargs: key-value pairs (e.g. {raise_on_error=True})
+            **kwargs: key-value pairs (e.g. {raise_on_error=True, cache_ttl=60, timeout=(10, 60), retries=5})
         """
-        self.__endpoint = endpoint
-        self.__token = token
-        self.__encoding = "utf-8"
-        self.__raise_on_error = kwargs.get('raise_on_error', None)
+        super().__init__(token, endpoint, **kwargs)
+        self.__cache_ttl = kwargs.get('cache_ttl', 0)
+        self.__cache: Dict[bytes, Tuple[float, Dict]] = {}
         self.__session = Session()
-        self.__session.headers.update({
-            "Authorization": f"Bearer {self.__token}",
-            # See #
-            # https://github.blog/2021-11-16-graphql-global-id-migration-update/
-            'X-Github-Next-Global-ID': '1'
-        })
-
-    @property
-    def token(self) -> str:
-        """ Returns the bearer token. """
-        return self.__token
-
-    @property
-    def encoding(self) -> str:
-        """ Returns the default encoding to be expected from query files. """
-        return self.__encoding
+        self.__session.headers.update(self._headers())
+        # Resolve proxies and CA bundle from the environment once instead of on
+        # every request. This also keeps a ~/.netrc from replacing the token.
+        settings = self.__session.merge_environment_settings(endpoint, {}, None, None, None)
+        self.__session.proxies = settings["proxies"]
+        self.__session.verify = settings["verify"]
+        self.__session.trust_env = False
+        # Mutations are sent through a twin session that never retries. It
+        # shares the headers and proxies of the session above.
+        self.__mutation_session = Session()
+        self.__mutation_session.headers = self.__session.headers
+        self.__mutation_session.proxies = self.__session.proxies
+        self.__mutation_session.verify = self.__session.verify
+        self.__mutation_session.trust_env = False
+        for session, retries in ((self.__session, kwargs.get('retries', 5)), (self.__mutation_session, 0)):
+            adapter = _shared_adapter(retries)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
 
     def query_from_file(self,
                         filename: str,
@@ -82,9 +269,7 @@ class GithubGraphQL:
             variables (dict): The variables to be applied to the query.
             **kwargs: key-value pairs (e.g. {raise_on_error=True})
         """
-        with open(file=filename, mode="r", encoding=self.encoding) as file_handle:
-            query = file_handle.read()
-        return self.query(query, variables, **kwargs)
+        return self.query(self._read_query_file(filename), variables, **kwargs)
 
     def __enter__(self):
         return self
@@ -98,8 +283,60 @@ class GithubGraphQL:
         self.close()
 
     def close(self):
-        """ Closes the session. """
-        self.__session.close()
+        """
+        Closes the session. Connections are pooled process-wide and stay open
+        for other instances, so calling this is optional. The client can still
+        be used afterwards, as with a closed requests session.
+        """
+        # Session.close() would close the shared pools for every instance and
+        # detaching them would break further queries, so there is nothing to do.
+
+    def __session_for(self, query: str) -> Session:
+        """ Returns the session to send `query` with. """
+        return self.__mutation_session if _MUTATION_RE.search(query) else self.__session
+
+    @staticmethod
+    def __cache_key(query: str, variables: Optional[Dict[str, Union[str, int]]]) -> bytes:
+        """ Returns the key under which the result of a query is cached. """
+        text = query + "\x00" + json.dumps(variables, sort_keys=True)
+        return hashlib.blake2b(text.encode()).digest()
+
+    def __cache_lookup(self, key: bytes) -> Optional[Dict]:
+        """ Returns the cached result for `key` unless it is missing or expired. """
+        if (entry := self.__cache.get(key)) is None:
+            return None
+        if time.monotonic() - entry[0] >= self.__cache_ttl:
+            del self.__cache[key]
+            return None
+        return entry[1]
+
+    def __cache_store(self, key: bytes, res: Dict):
+        """
+        Caches `res` under `key`. Drops the least recently stored entry if the
+        cache is full.
+        """
+        self.__cache.pop(key, None)
+        if len(self.__cache) >= _CACHE_MAX_ENTRIES:
+            del self.__cache[next(iter(self.__cache))]
+        self.__cache[key] = (time.monotonic(), res)
+
+    def invalidate(self,
+                   query: str,
+                   variables: Dict[str,
+                                   Union[str,
+                                         int]] = None):
+        """
+        Removes the cached result for the given query and variables (if any).
+
+        Args:
+            query (str): The GraphQL query.
+            variables (dict): The variables that were applied to the query.
+        """
+        self.__cache.pop(self.__cache_key(query, variables), None)
+
+    def clear_cache(self):
+        """ Removes all cached query results. """
+        self.__cache.clear()
 
     def query(self,
               query: str,
@@ -112,6 +349,12 @@ class GithubGraphQL:
         the plain result is returned. If you want to raise an exception in case
         of an error you can set `raise_on_error` to `True`.
 
+        When the client was created with a `cache_ttl` greater than zero, the
+        result of a query is cached for that many seconds and identical calls
+        are answered without contacting the endpoint. Mutations and results
+        with errors are never cached. Cached results are shared between calls,
+        so don't modify them.
+
         Args:
             query (str): The GraphQL query.
             variables (dict): The variables to be applied to the query.
@@ -119,15 +362,202 @@ class GithubGraphQL:
 
         Raises:
             RuntimeError: In case of an error when `raise` is `True`.
+            JSONDecodeError: If the response is not a JSON document.
 
         Returns:
             Result: The result of the query. Inspect the result for errors!
         """
-        req = self.__session.post(
-            url=self.__endpoint,
-            json={"query": query, "variables": variables})
-        req.raise_for_status()
-        res = dict(req.json())
-        if "errors" in res and kwargs.get('raise_on_error', self.__raise_on_error):
-            raise RuntimeError(str(fnc.get("errors[0].message", res, default="GraphQL Error")))
+        return self.__execute(query,
+                              variables,
+                              lambda: _dumps({"query": query, "variables": variables}),
+                              **kwargs)
+
+    def query_stream(self,
+                     query: str,
+                     variables: Dict[str,
+                                     Union[str,
+                                           int]] = None,
+                     path: str = "data",
+                     **kwargs) -> Iterator[Any]:
+        """
+        Execute the query with the variables applied and yield the values found
+        at `path` in the result while the response is being received. The
+        result as a whole is never held in memory, which helps with queries
+        that return large lists:
+
+            for issue in g.query_stream(query, path="data.repository.issues.nodes.item"):
+                print(issue["title"])
+
+        Path components are separated by dots and `item` stands for every
+        element of a list (see https://github.com/ICRAR/ijson). Errors in the
+        result are only raised (if requested by `raise_on_error`) once all
+        values were yielded. Results are never cached.
+
+        This requires the `stream` extra: `pip install "ghgql[stream]"`
+
+        Args:
+            query (str): The GraphQL query.
+            variables (dict): The variables to be applied to the query.
+            path (str): The path of the values to yield.
+            **kwargs: key-value pairs (e.g. {raise_on_error=True})
+
+        Raises:
+            ImportError: If ijson is not installed.
+            RuntimeError: In case of an error when `raise` is `True`.
+            JSONDecodeError: If the response is not a JSON document.
+        """
+        if ijson is None:
+            raise ImportError('query_stream() requires ijson, install "ghgql[stream]"')
+        values = ijson.sendable_list()
+        errors = ijson.sendable_list()
+        parsers = [ijson.items_coro(values, path, use_float=True),
+                   ijson.items_coro(errors, "errors.item", use_float=True)]
+        with self.__session_for(query).post(
+                url=self.endpoint,
+                data=_dumps({"query": query, "variables": variables}),
+                timeout=self.timeout,
+                stream=True) as req:
+            req.raise_for_status()
+            try:
+                for chunk in req.iter_content(chunk_size=65536):
+                    if not chunk:
+                        continue # An empty chunk would end the parsers
+                    for parser in parsers:
+                        parser.send(chunk)
+                    yield from values
+                    del values[:]
+                for parser in parsers:
+                    parser.close()
+            except ijson.JSONError as ex:
+                # Raise the same error as requests' Response.json() would
+                raise JSONDecodeError(str(ex), "", 0) from ex
+        yield from values
+        if errors:
+            self._check_result({"errors": list(errors)}, **kwargs)
+
+    def compile(self, query: str) -> "CompiledQuery":
+        """
+        Returns a callable that executes `query` with the variables it is
+        called with. The query is serialized only once, which pays off when
+        the same query is sent many times, e.g. to paginate:
+
+            next_page = g.compile(query)
+            res = next_page({"cursor": None})
+            res = next_page({"cursor": res["data"]["viewer"]["repositories"]["pageInfo"]["endCursor"]})
+
+        Args:
+            query (str): The GraphQL query.
+
+        Returns:
+            CompiledQuery: The compiled query.
+        """
+        return CompiledQuery(query, self.__execute)
+
+    def __execute(self,
+                  query: str,
+                  variables: Optional[Dict[str, Union[str, int]]],
+                  body: Callable[[], bytes],
+                  **kwargs) -> Dict:
+        """
+        Returns the result of `query` from the cache or POSTs the payload
+        returned by `body` to the endpoint. See `query()` for details.
+        """
+        key = res = None
+        if self.__cache_ttl > 0 and not _MUTATION_RE.search(query):
+            key = self.__cache_key(query, variables)
+            res = self.__cache_lookup(key)
+        if res is None:
+            req = self.__session_for(query).post(
+                url=self.endpoint,
+                data=body(),
+                timeout=self.timeout)
+            req.raise_for_status()
+            res = _loads(req.content)
+            if key is not None and "errors" not in res:
+                self.__cache_store(key, res)
+        self._check_result(res, **kwargs)
         return res
+
+    def query_batch(self,
+                    queries: Iterable[Tuple[str,
+                                            Dict[str,
+                                                 Union[str,
+                                                       int]]]],
+                    **kwargs) -> List[Dict]:
+        """
+        Execute all `(query, variables)` pairs with as few requests as possible
+        and return their results in the same order. Up to `batch_size` queries
+        (10 by default) are merged into a single request (see `ghgql.batch`).
+
+        Mind that a query which fails to validate makes every other query in
+        the same request fail, too.
+
+        Args:
+            queries (iterable): The `(query, variables)` pairs to execute.
+            **kwargs: key-value pairs (e.g. {raise_on_error=True, batch_size=10})
+
+        Raises:
+            ValueError: If a query cannot be merged with others.
+            RuntimeError: In case of an error when `raise` is `True`.
+
+        Returns:
+            list: The results of the queries. Inspect the results for errors!
+        """
+        queries = list(queries)
+        batch_size = kwargs.pop('batch_size', 10)
+        results: List[Dict] = []
+        for start in range(0, len(queries), batch_size):
+            batch = queries[start:start + batch_size]
+            query, variables, aliases = merge_queries(batch)
+            res = self.query(query, variables, raise_on_error=False)
+            results += split_result(res, aliases, len(batch))
+        for res in results:
+            self._check_result(res, **kwargs)
+        return results
+
+
+class CompiledQuery:
+    """
+    A query whose JSON payload is serialized ahead of time so that only the
+    variables need to be serialized when it is executed. Use
+    `GithubGraphQL.compile()` to create one.
+    """
+
+    def __init__(self, query: str, execute: Callable[..., Dict]):
+        """
+        Creates a compiled `query` that is sent by `execute`.
+
+        Args:
+            query (str): The GraphQL query.
+            execute (callable): Executes the query, given the query, its
+                variables and a function returning the serialized payload.
+        """
+        self.__query = query
+        self.__execute = execute
+        self.__prefix = b'{"query":' + _dumps(query) + b',"variables":'
+
+    @property
+    def query(self) -> str:
+        """ Returns the GraphQL query. """
+        return self.__query
+
+    def __call__(self,
+                 variables: Dict[str,
+                                 Union[str,
+                                       int]] = None,
+                 **kwargs) -> Dict:
+        """
+        Execute the query with the variables applied. See
+        `GithubGraphQL.query()` for details.
+
+        Args:
+            variables (dict): The variables to be applied to the query.
+            **kwargs: key-value pairs (e.g. {raise_on_error=True})
+
+        Returns:
+            dict: The result of the query. Inspect the result for errors!
+        """
+        return self.__execute(self.__query,
+                              variables,
+                              lambda: self.__prefix + _dumps(variables) + b"}",
+                              **kwargs)
@@ -0,0 +1,109 @@
+""" Helpers shared by the test modules """
+
+import functools
+import inspect
+import json
+import os
+from os import getenv
+import pytest
+import requests
+import vcr
+
+
+# The login that belongs to GITHUB_TOKEN. Falls back to the login of the
+# maintainer's token, which recordings are usually made with.
+VIEWER_LOGIN = getenv(key="GITHUB_LOGIN", default="kwk")
+
+
+def fake_response(payload: dict, status_code: int = 200) -> requests.Response:
+    """
+    Returns a response object that carries the given payload as JSON. Use it
+    to answer requests without talking to the Github API.
+    """
+    res = requests.Response()
+    res.status_code = status_code
+    res._content = json.dumps(payload).encode("utf-8") # pylint: disable=protected-access
+    return res
+
+
+def _json_body(request1, request2):
+    """ Matches requests whose bodies are the same JSON documents, however serialized. """
+    assert json.loads(request1.body) == json.loads(request2.body)
+
+
+def _scrub_response(response):
+    """ Drops all headers but the content type from a response before it is recorded. """
+    response["headers"] = {key: value for key, value in response["headers"].items()
+                           if key.lower() == "content-type"}
+    return response
+
+
+# Set VCR_RECORD_MODE=none to only replay recordings. A test without one then
+# fails instead of being skipped or recorded.
+VCR = vcr.VCR(
+    cassette_library_dir=os.path.join(os.path.dirname(__file__), "cassettes"),
+    record_mode=getenv("VCR_RECORD_MODE", "once"),
+    match_on=["method", "uri", "json_body"],
+    filter_headers=["authorization"],
+    decode_compressed_response=True,
+    before_record_response=_scrub_response)
+VCR.register_matcher("json_body", _json_body)
+
+
+def skip_without_recording(test_case, cassette: str):
+    """
+    Skips the test unless the responses in `cassette` were recorded in
+    tests/cassettes or can be recorded with the test case's API token. Fails
+    the test instead if there is no recording and the record mode is `none`.
+    """
+    if os.path.exists(os.path.join(VCR.cassette_library_dir, cassette)):
+        return
+    if VCR.record_mode == "none":
+        test_case.fail(f"There is no recorded {cassette} to replay with VCR_RECORD_MODE=none.")
+    if test_case.api_token is None:
+        test_case.skipTest(
+            "Skipping test case because no GITHUB_TOKEN environment variable is set"
+            f" and there is no recorded {cassette}.")
+
+
+def use_cassette(func):
+    """
+    This is a decorator function you can use for tests that talk to the Github
+    API. The responses are replayed from
+    tests/cassettes/<class name>.<test name>.yaml. If that file doesn't exist
+    yet, the test talks to the Github API and records them, which needs a
+    GITHUB_TOKEN in the environment; otherwise the test is skipped. Delete the
+    file to record the responses again. The test is marked as an integration
+    test. Both regular and async tests can be decorated.
+    """
+    # Test cases of different classes may have the same name
+    cassette = func.__qualname__ + ".yaml"
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(test_case):
+            skip_without_recording(test_case, cassette)
+            with VCR.use_cassette(cassette):
+                await func(test_case)
+        return pytest.mark.integration(async_wrapper)
+
+    @functools.wraps(func)
+    def wrapper(test_case):
+        skip_without_recording(test_case, cassette)
+        with VCR.use_cassette(cassette):
+            func(test_case)
+    return pytest.mark.integration(wrapper)
+
+
+class GithubTokenMixin:
+    """ Gives a test case the Github API token from the environment. """
+
+    def setUp(self) -> None: # pylint: disable=invalid-name
+        """ Reads the token from the GITHUB_TOKEN environment variable. """
+        super().setUp()
+        self.__token = getenv(key="GITHUB_TOKEN", default=None)
+
+    @property
+    def api_token(self) -> str:
+        """ Returns the Github API token. """
+        return self.__token
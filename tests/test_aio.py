@@ -0,0 +1,113 @@
+""" Tests for ghgql.aio """
+
+import json
+import unittest
+from unittest import mock
+import requests
+from helpers import VIEWER_LOGIN, GithubTokenMixin, use_cassette
+import ghgql
+
+try:
+    import httpx
+except ImportError:
+    httpx = None # pylint: disable=invalid-name
+
+
+def fake_response(payload: dict, status_code: int = 200) -> "httpx.Response":
+    """
+    Returns a response object that carries the given payload as JSON. Use it
+    to answer requests without talking to the Github API.
+    """
+    return httpx.Response(status_code=status_code, json=payload,
+                          request=httpx.Request("POST", "https://api.github.com/graphql"))
+
+
+@unittest.skipIf(httpx is None, "httpx is not installed")
+class TestAsyncGithubGraphQL(GithubTokenMixin, unittest.IsolatedAsyncioTestCase):
+    """ Testcases for the AsyncGithubGraphQL class. """
+
+    async def test_session_headers_have_token_set(self):
+        """ Test that the client is equiped with a bearer token in the header. """
+        async with ghgql.AsyncGithubGraphQL(token="foobar") as ghapi:
+            self.assertEqual(ghapi.session_headers["Authorization"], "Bearer foobar")
+
+    async def test_query_file_not_found(self):
+        """ Test what happens when we try to query with a file that doesn't exist. """
+        async with ghgql.AsyncGithubGraphQL() as ghapi:
+            with self.assertRaises(FileNotFoundError):
+                await ghapi.query_from_file("/this/file/does/not/exist")
+
+    async def test_query_with_raise_on_error(self):
+        """ Test that we raise an error when requested """
+        payload = {'errors': [{'message': "Field 'MADEUPFIELD' doesn't exist on type 'User'"}]}
+        with mock.patch.object(httpx.AsyncClient, "post", return_value=fake_response(payload)):
+            async with ghgql.AsyncGithubGraphQL() as ghapi:
+                self.assertEqual(await ghapi.query(query="query { viewer { MADEUPFIELD } }"), payload)
+                with self.assertRaises(RuntimeError) as ex:
+                    await ghapi.query(query="query { viewer { MADEUPFIELD } }", raise_on_error=True)
+                self.assertEqual(str(ex.exception), "Field 'MADEUPFIELD' doesn't exist on type 'User'")
+
+    async def test_non_json_response(self):
+        """ Test that a response that isn't JSON raises the same error as GithubGraphQL does. """
+        res = httpx.Response(status_code=200, content=b"<html></html>",
+                             request=httpx.Request("POST", "https://api.github.com/graphql"))
+        with mock.patch.object(httpx.AsyncClient, "post", return_value=res):
+            async with ghgql.AsyncGithubGraphQL() as ghapi:
+                with self.assertRaises(requests.JSONDecodeError):
+                    await ghapi.query(query="query { viewer { login } }")
+
+    async def test_query_many(self):
+        """ Test that query_many returns the results in the order of the queries """
+        async def post(url, content):  # pylint: disable=unused-argument
+            return fake_response({"data": json.loads(content)["variables"]})
+
+        with mock.patch.object(httpx.AsyncClient, "post", side_effect=post):
+            async with ghgql.AsyncGithubGraphQL() as ghapi:
+                results = await ghapi.query_many(("query { viewer { login } }", {"i": i}) for i in range(5))
+        self.assertEqual(results, [{"data": {"i": i}} for i in range(5)])
+
+    async def test_query_batch(self):
+        """ Test that batches are sent concurrently and the results are split up """
+        async def post(url, content):  # pylint: disable=unused-argument
+            query = json.loads(content)["query"]
+            aliases = [token for token in query.split() if token.startswith("q") and token[1].isdigit()]
+            return fake_response({"data": {alias: {"login": alias} for alias in aliases}})
+
+        with mock.patch.object(httpx.AsyncClient, "post", side_effect=post) as mock_post:
+            async with ghgql.AsyncGithubGraphQL() as ghapi:
+                results = await ghapi.query_batch([("query { viewer { login } }", None)] * 3, batch_size=2)
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(results, [{"data": {"viewer": {"login": "q0_viewer"}}},
+                                   {"data": {"viewer": {"login": "q1_viewer"}}},
+                                   {"data": {"viewer": {"login": "q0_viewer"}}}])
+
+    @use_cassette
+    async def test_ok_get_viewers_login(self):
+        """ Test that we can get the login of the viewer concurrently """
+        async with ghgql.AsyncGithubGraphQL(token=self.api_token) as ghapi:
+            query = " query { viewer { login } }"
+            expected = {"data": {"viewer": {"login": VIEWER_LOGIN}}}
+            actual = await ghapi.query_many([(query, None), (query, None)])
+            self.assertEqual(actual, [expected, expected])
+
+    @use_cassette
+    async def test_independent_queries_concurrently(self):
+        """
+        Test the queries of the synchronous test cases in one go. They are
+        independent, so they take about as long as the slowest of them.
+        """
+        cases = [
+            (" query { viewer { login } }", {"viewer": {"login": VIEWER_LOGIN}}, None),
+            (" query { viewer { MADEUPFIELD } }", None, "Field 'MADEUPFIELD' doesn't exist on type 'User'"),
+            ("foo", None, 'Parse error on "foo" (IDENTIFIER) at [1, 1]'),
+            ("", None, 'A query attribute must be specified and must be a string.'),
+        ]
+        async with ghgql.AsyncGithubGraphQL(token=self.api_token) as ghapi:
+            actual = await ghapi.query_many((query, None) for query, _, _ in cases)
+        for (query, data, message), res in zip(cases, actual):
+            with self.subTest(query=query):
+                self.assertEqual(res.get("data"), data)
+                self.assertEqual(res["errors"][0]["message"] if "errors" in res else None, message)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+""" Tests for ghgql.batch """
+
+import json
+import unittest
+from unittest import mock
+import requests
+from helpers import fake_response
+import ghgql
+from ghgql.batch import merge_queries, split_result
+
+
+class TestBatch(unittest.TestCase):
+    """ Testcases for merging queries and splitting their results. """
+
+    def test_merge_queries(self):
+        """ Test that fields are aliased and variables and fragments are renamed. """
+        query, variables, aliases = merge_queries([
+            ("query { viewer { login } }", None),
+            ("""
+            # Find a project
+            query Project($org: String!, $number: Int = 1) {
+                organization(login: $org) { projectV2(number: $number) { ...Project } }
+                limit: rateLimit { remaining }
+            }
+            fragment Project on ProjectV2 { title }
+            """, {"org": "kwk-org", "number": 1}),
+        ])
+        self.assertEqual(query, " ".join([
+            "query ( $q1_org : String ! $q1_number : Int = 1 ) {",
+            "q0_viewer : viewer { login }",
+            "q1_organization : organization ( login : $q1_org )",
+            "{ projectV2 ( number : $q1_number ) { ... q1_Project } }",
+            "q1_limit : rateLimit { remaining }",
+            "} fragment q1_Project on ProjectV2 { title }",
+        ]))
+        self.assertEqual(variables, {"q1_org": "kwk-org", "q1_number": 1})
+        self.assertEqual(aliases, {"q0_viewer": (0, "viewer"),
+                                   "q1_organization": (1, "organization"),
+                                   "q1_limit": (1, "limit")})
+
+    def test_merge_queries_inline_fragment(self):
+        """ Test that fields of top-level inline fragments are aliased, too. """
+        query, _, aliases = merge_queries([('{ ... on Query @include(if: true) { viewer { login } } }', None)])
+        self.assertEqual(query, "query { ... on Query @ include ( if : true ) { q0_viewer : viewer { login } } }")
+        self.assertEqual(aliases, {"q0_viewer": (0, "viewer")})
+
+    def test_merge_queries_unsupported(self):
+        """ Test that documents which cannot be merged are rejected. """
+        for query in ("",
+                      "query",
+                      "foo",
+                      "{ viewer { login } } { viewer { login } }",
+                      "mutation { addStar(input: {starrableId: \"foo\"}) { clientMutationId } }",
+                      "query { ...Viewer } fragment Viewer on Query { viewer { login } }",
+                      "query { viewer { login }",
+                      "query { viewer { login } } ?"):
+            with self.subTest(query=query):
+                with self.assertRaises(ValueError):
+                    merge_queries([(query, None)])
+
+    def test_split_result(self):
+        """ Test that data and errors end up in the result of the query they belong to. """
+        aliases = {"q0_viewer": (0, "viewer"), "q1_organization": (1, "organization")}
+        res = {"data": {"q0_viewer": {"login": "kwk"}, "q1_organization": None},
+               "errors": [{"message": "Not found", "path": ["q1_organization"]},
+                          {"message": "Something went wrong"}]}
+        self.assertEqual(split_result(res, aliases, 2), [
+            {"data": {"viewer": {"login": "kwk"}},
+             "errors": [{"message": "Something went wrong"}]},
+            {"data": {"organization": None},
+             "errors": [{"message": "Not found", "path": ["organization"]},
+                        {"message": "Something went wrong"}]},
+        ])
+
+    def test_split_result_without_data(self):
+        """ Test that errors of a request that failed entirely go to all results. """
+        res = {"errors": [{"message": "Parse error"}]}
+        self.assertEqual(split_result(res, {}, 2), [res, res])
+
+    def test_query_batch(self):
+        """ Test that queries are sent in batches and the results are split up. """
+        def post(**kwargs):
+            query = json.loads(kwargs["data"])["query"]
+            aliases = [token for token in query.split() if token.startswith("q") and token[1].isdigit()]
+            return fake_response({"data": {alias: {"login": alias} for alias in aliases}})
+
+        with mock.patch.object(requests.Session, "post", side_effect=post) as mock_post:
+            with ghgql.GithubGraphQL() as ghapi:
+                results = ghapi.query_batch([("query { viewer { login } }", None)] * 3, batch_size=2)
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(results, [{"data": {"viewer": {"login": "q0_viewer"}}},
+                                   {"data": {"viewer": {"login": "q1_viewer"}}},
+                                   {"data": {"viewer": {"login": "q0_viewer"}}}])
+
+    def test_query_batch_with_raise_on_error(self):
+        """ Test that we raise the error of the query it belongs to """
+        res = {"data": {"q0_viewer": {"login": "kwk"}, "q1_repository": None},
+               "errors": [{"message": "Could not resolve to a Repository", "path": ["q1_repository"]}]}
+        with mock.patch.object(requests.Session, "post", return_value=fake_response(res)):
+            with ghgql.GithubGraphQL(raise_on_error=True) as ghapi:
+                with self.assertRaises(RuntimeError) as ex:
+                    ghapi.query_batch([("query { viewer { login } }", None),
+                                       ('query { repository(owner: "kwk", name: "foo") { id } }', None)])
+        self.assertEqual(str(ex.exception), "Could not resolve to a Repository")
+
+if __name__ == '__main__':
+    unittest.main()
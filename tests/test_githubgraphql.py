@@ -1,63 +1,177 @@
 """ Tests for ghgql.ghgql """
 
 import unittest
+from unittest import mock
 from uuid import uuid4
 import functools
+import json
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from tempfile import NamedTemporaryFile
+import os
 from os import getenv
 from contextlib import contextmanager
+import pytest
 import requests
-import fnc
+from helpers import VCR, VIEWER_LOGIN, GithubTokenMixin, fake_response, skip_without_recording, use_cassette
 import ghgql
 
+# A query for a field that doesn't exist and what Github answers to it
+_MADEUPFIELD_QUERY = " query { viewer { MADEUPFIELD } }"
+_MADEUPFIELD_RESULT = {'errors': [{'extensions': {'code': 'undefinedField',
+                                                  'fieldName': 'MADEUPFIELD',
+                                                  'typeName': 'User'},
+                                   'locations': [{'column': 19, 'line': 1}],
+                                   'message': "Field 'MADEUPFIELD' doesn't exist on type 'User'",
+                                   'path': ['query', 'viewer', 'MADEUPFIELD']}]}
 
-def skip_if_no_token(func):
+# What Github answers to the query "foo"
+_WRONG_QUERY_RESULT = {'errors': [{'locations': [{'column': 1, 'line': 1}],
+                                   'message': 'Parse error on "foo" (IDENTIFIER) at [1, 1]'}]}
+
+# What Github answers to an empty query
+_EMPTY_QUERY_RESULT = {'errors': [
+    {'message': 'A query attribute must be specified and must be a string.'}]}
+
+# The query of test_real_example()
+_REAL_EXAMPLE_QUERY = """
+query($org: String!, $number: Int!) {
+    organization(login: $org) {
+        projectV2(number: $number) {
+        items(last: 100) {
+            nodes {
+            id
+
+            fieldValues(first: 8) {
+                nodes {
+                ... on ProjectV2ItemFieldSingleSelectValue {
+                    name
+                    field {
+                    ... on ProjectV2FieldCommon {
+                        name
+                    }
+                    }
+                }
+                ... on ProjectV2ItemFieldTextValue {
+                    text
+                    field {
+                    ... on ProjectV2FieldCommon {
+                        name
+                    }
+                    }
+                }
+                ... on ProjectV2ItemFieldPullRequestValue {
+                    pullRequests(last: 10) {
+                    nodes {
+                        url
+                        number
+                    }
+                    }
+                }
+                }
+            }
+
+            content {
+                ...on Issue {
+                title
+                number
+                url
+                state
+                milestone {
+                    number
+                }
+                }
+            }
+            }
+        }
+        }
+    }
+}
+"""
+
+# Getters for the parts of the result of _REAL_EXAMPLE_QUERY, bound once.
+_get_nodes = functools.partial(ghgql.dotted_get, path="data.organization.projectV2.items.nodes")
+_get_milestone_number = functools.partial(ghgql.dotted_get, path="content.milestone.number")
+
+
+@contextmanager
+def local_endpoint(*responses):
     """
-    This is a decorator function you can use to skip a test if no GITHUB_TOKEN
-    token is specifyied in the environment.
+    Serves the given `(status_code, payload)` pairs, one per request, from a
+    local HTTP server. The payload may also be a function that is called with
+    the client's address and returns the payload. A payload of bytes is sent
+    as is instead of as JSON. Use this as a context manager that yields the
+    endpoint:
+
+        with local_endpoint((502, {}), (200, {"data": {}})) as endpoint:
+            ghgql.GithubGraphQL(endpoint=endpoint).query("query { viewer { login } }")
     """
-    @functools.wraps(func)
-    def wrapper(test_case):
-        if test_case.api_token is None:
-            test_case.skipTest(
-                "Skipping test case because no GITHUB_TOKEN environment variable is set.")
-        func(test_case)
-    return wrapper
+    pending = list(responses)
 
+    class Handler(BaseHTTPRequestHandler):
+        """ Answers every POST request with the next pending response. """
 
-class TestGithubGraphQL(unittest.TestCase):
-    """ Testcases for the GithubGraphQL class. """
+        protocol_version = "HTTP/1.1"
 
-    def setUp(self) -> None:
-        self.__token = getenv(key="GITHUB_TOKEN", default=None)
-        self.__viewer_login = getenv(key="GITHUB_LOGIN", default=None)
+        def do_POST(self): # pylint: disable=invalid-name
+            """ Sends the next pending response. """
+            self.rfile.read(int(self.headers["Content-Length"]))
+            status_code, payload = pending.pop(0)
+            if callable(payload):
+                payload = payload(self.client_address)
+            if isinstance(payload, bytes):
+                body, content_type = payload, "text/html"
+            else:
+                body, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+            self.send_response(status_code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
 
-    @property
-    def api_token(self) -> str:
-        """ Returns the Github API token. """
-        return self.__token
+        def log_message(self, *args): # pylint: disable=arguments-differ
+            """ Keeps the test output clean. """
 
-    @property
-    def viewer_login(self) -> str:
-        """ Returns the expected Github login that corresponds to the API token """
-        return self.__viewer_login
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}/graphql"
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
 
-    @contextmanager
-    def get_query_as_file(self, query: str) -> str:
-        """
-        Returns a temporary filename with the given query written to it.
-        Use this as a context manager:
 
-            with self.get_query_as_file(query="query {}") as filename:
-                g.query_from_file(filename)
+class TestGithubGraphQL(GithubTokenMixin, unittest.TestCase):
+    """ Testcases for the GithubGraphQL class. """
+
+    @classmethod
+    def setUpClass(cls):
+        # Tests that don't need a differently configured client share this
+        # one and thus its keep-alive connection.
+        cls.ghapi = ghgql.GithubGraphQL(token=getenv(key="GITHUB_TOKEN", default=None))
+        cls.addClassCleanup(cls.ghapi.close)
+        cls.batched = None
+
+    def batched_result(self, index: int) -> dict:
+        """
+        Returns the result of the query at `index` in a batch of the results
+        that several tests only read. The batch is fetched in one request by
+        the first test that needs it. See use_cassette() for how the responses
+        are recorded.
         """
-        file_handle = NamedTemporaryFile(mode="w+", encoding="utf-8")
-        file_handle.writelines(query)
-        file_handle.flush()
-        try:
-            yield file_handle.name
-        finally:
-            file_handle.close()
+        cls = type(self)
+        if (batched := cls.batched) is None:
+            cassette = cls.__name__ + ".yaml"
+            skip_without_recording(self, cassette)
+            with VCR.use_cassette(cassette):
+                batched = cls.batched = self.ghapi.query_batch([
+                    (" query { viewer { login } }", None),
+                    (_REAL_EXAMPLE_QUERY, {"org": "kwk-org", "number": 1}),
+                ])
+        return batched[index]
 
     def test_query_file_not_found(self):
         """ Test what happens when we try to query with a file that doesn't exist. """
@@ -72,110 +186,71 @@ class TestGithubGraphQL(unittest.TestCase):
             with self.assertRaises(IsADirectoryError):
                 ghapi.query_from_file("/")
 
-    @skip_if_no_token
+    @use_cassette
     def test_wrong_query(self):
         """ Test what happens when we try use an invalid query string """
-        with ghgql.GithubGraphQL(token=self.api_token) as ghapi:
-            query = "foo"
-            with self.get_query_as_file(query) as filename:
-                expected = {'errors': [{'locations': [{'column': 1, 'line': 1}],
-                                        'message': 'Parse error on "foo" (IDENTIFIER) at [1, 1]'}]}
-                self.assertEqual(ghapi.query_from_file(filename), expected)
-
-    @skip_if_no_token
+        self.assertEqual(self.ghapi.query(query="foo"), _WRONG_QUERY_RESULT)
+
+    @use_cassette
     def test_empty_query(self):
         """ Test what happens when we try use an empty query string """
-        with ghgql.GithubGraphQL(token=self.api_token) as ghapi:
-            query = ""
-            with self.get_query_as_file(query) as filename:
-                expected = {'errors': [
-                    {'message': 'A query attribute must be specified and must be a string.'}]}
-                self.assertEqual(ghapi.query_from_file(filename), expected)
+        self.assertEqual(self.ghapi.query(query=""), _EMPTY_QUERY_RESULT)
 
     def test_wrong_endpoint_returns_non_json(self):
         """ Test what happens when we try use an invalid endpoint """
-        with ghgql.GithubGraphQL(endpoint="https://www.example.com") as ghapi:
-            query = " query { viewer { login } }"
-            with self.get_query_as_file(query) as filename:
+        with local_endpoint((200, b"<!doctype html><html></html>")) as endpoint:
+            with ghgql.GithubGraphQL(endpoint=endpoint) as ghapi:
+                query = " query { viewer { login } }"
                 with self.assertRaises(requests.JSONDecodeError):
-                    ghapi.query_from_file(filename)
+                    ghapi.query(query=query)
 
-    @skip_if_no_token
+    @pytest.mark.integration
     def test_ok_get_viewers_login(self):
         """ Test that we can get the login of the viewer """
-        with ghgql.GithubGraphQL(token=self.api_token) as ghapi:
-            query = " query { viewer { login } }"
-            with self.get_query_as_file(query) as filename:
-                expected = {"data": {"viewer": {"login": self.viewer_login}}}
-                actual = ghapi.query_from_file(filename)
-                self.assertEqual(actual, expected)
-
-    @skip_if_no_token
+        expected = {"data": {"viewer": {"login": VIEWER_LOGIN}}}
+        actual = self.batched_result(0)
+        self.assertEqual(actual, expected)
+
+    @use_cassette
     def test_undefined_field_madeupfield(self):
         """ Test that we get an error when we try to query an undefined field """
-        with ghgql.GithubGraphQL(token=self.api_token) as ghapi:
-            query = " query { viewer { MADEUPFIELD } }"
-            with self.get_query_as_file(query) as filename:
-                expected = {'errors': [{'extensions': {'code': 'undefinedField',
-                                                       'fieldName': 'MADEUPFIELD',
-                                                       'typeName': 'User'},
-                                        'locations': [{'column': 19, 'line': 1}],
-                                        'message': "Field 'MADEUPFIELD' doesn't exist on type 'User'",
-                                        'path': ['query', 'viewer', 'MADEUPFIELD']}]}
-                actual = ghapi.query_from_file(filename)
-                self.assertEqual(actual, expected)
-                self.assertIsInstance(actual, dict)
-
-    @skip_if_no_token
-    def test_query_with_raise_on_error(self):
-        """ Test that we raise an error when requested """
-        with ghgql.GithubGraphQL(token=self.api_token) as ghapi:
-            query = " query { viewer { MADEUPFIELD } }"
-            with self.get_query_as_file(query=query) as filename:
-                expected = {'errors': [{'extensions': {'code': 'undefinedField',
-                                                       'fieldName': 'MADEUPFIELD',
-                                                       'typeName': 'User'},
-                                        'locations': [{'column': 19, 'line': 1}],
-                                        'message': "Field 'MADEUPFIELD' doesn't exist on type 'User'",
-                                        'path': ['query', 'viewer', 'MADEUPFIELD']}]}
-                with self.assertRaises(RuntimeError) as ex:
-                    ghapi.query_from_file(filename=filename, raise_on_error=True)
-                self.assertAlmostEqual(str(ex.exception), fnc.get("errors[0].message", expected))
-
-    @skip_if_no_token
-    def test_query_with_raise_on_error_in_ctor(self):
-        """ Test that we raise an error when requested """
-        with ghgql.GithubGraphQL(token=self.api_token, raise_on_error=True) as ghapi:
-            query = " query { viewer { MADEUPFIELD } }"
-            with self.get_query_as_file(query=query) as filename:
-                expected = {'errors': [{'extensions': {'code': 'undefinedField',
-                                                       'fieldName': 'MADEUPFIELD',
-                                                       'typeName': 'User'},
-                                        'locations': [{'column': 19, 'line': 1}],
-                                        'message': "Field 'MADEUPFIELD' doesn't exist on type 'User'",
-                                        'path': ['query', 'viewer', 'MADEUPFIELD']}]}
-                with self.assertRaises(RuntimeError) as ex:
-                    ghapi.query_from_file(filename=filename)
-                self.assertAlmostEqual(str(ex.exception), fnc.get("errors[0].message", expected))
+        actual = self.ghapi.query(query=_MADEUPFIELD_QUERY)
+        self.assertEqual(actual, _MADEUPFIELD_RESULT)
+        self.assertIsInstance(actual, dict)
 
-    @skip_if_no_token
-    def test_raise_on_error_precedence(self):
+    def test_query_with_raise_on_error(self):
         """
-        Test that we don't raise an error when disable locally but enabled
-        globally.
+        Test that we raise an error when requested in the constructor or the
+        call, and that the latter takes precedence.
         """
-        with ghgql.GithubGraphQL(token=self.api_token, raise_on_error=True) as ghapi:
-            query = " query { viewer { MADEUPFIELD } }"
-            expected = {'errors': [{'extensions': {'code': 'undefinedField',
-                                                    'fieldName': 'MADEUPFIELD',
-                                                    'typeName': 'User'},
-                                    'locations': [{'column': 19, 'line': 1}],
-                                    'message': "Field 'MADEUPFIELD' doesn't exist on type 'User'",
-                                    'path': ['query', 'viewer', 'MADEUPFIELD']}]}
-            # This should not raise an exception because it was explicitly
-            # disabled locally:
-            actual = ghapi.query(query=query, raise_on_error=False)
-            self.assertEqual(actual, expected)
+        cases = [
+            # (raise_on_error in constructor, in call, expect an error)
+            ({}, {}, False),
+            ({}, {"raise_on_error": True}, True),
+            ({"raise_on_error": True}, {}, True),
+            ({"raise_on_error": True}, {"raise_on_error": False}, False),
+            ({"raise_on_error": False}, {"raise_on_error": True}, True),
+        ]
+        with mock.patch.object(requests.Session, "post",
+                               side_effect=lambda **_: fake_response(_MADEUPFIELD_RESULT)):
+            for ctor_kwargs, kwargs, raises in cases:
+                with self.subTest(ctor_kwargs=ctor_kwargs, kwargs=kwargs), \
+                     ghgql.GithubGraphQL(**ctor_kwargs) as ghapi:
+                    if raises:
+                        with self.assertRaises(RuntimeError) as ex:
+                            ghapi.query(query=_MADEUPFIELD_QUERY, **kwargs)
+                        self.assertEqual(str(ex.exception), ghgql.dotted_get(_MADEUPFIELD_RESULT, "errors[0].message"))
+                    else:
+                        self.assertEqual(ghapi.query(query=_MADEUPFIELD_QUERY, **kwargs), _MADEUPFIELD_RESULT)
+
+    def test_raise_on_error_without_message(self):
+        """ Test that we raise a generic error when the error has no message """
+        with mock.patch.object(requests.Session, "post",
+                               side_effect=lambda **_: fake_response({"errors": [{}]})):
+            with ghgql.GithubGraphQL(raise_on_error=True) as ghapi:
+                with self.assertRaises(RuntimeError) as ex:
+                    ghapi.query(query="query { viewer { login } }")
+                self.assertEqual(str(ex.exception), "GraphQL Error")
 
     # Test for https://github.com/kwk/ghgql/issues/4
     def test_session_headers_have_token_set(self):
@@ -187,74 +262,314 @@ class TestGithubGraphQL(unittest.TestCase):
         self.assertTrue("Authorization" in headers, "session headers are missing Authorization")
         self.assertEqual(headers["Authorization"], "Bearer foobar", "Authorization token in session headers mismatch")
 
-    @skip_if_no_token
+    def test_session_headers_without_token(self):
+        """ Test that a missing token (e.g. from os.getenv()) doesn't break the client. """
+        with ghgql.GithubGraphQL(token=None) as ghapi:
+            self.assertEqual(ghapi.session_headers["Authorization"], "Bearer None")
+
+    @pytest.mark.integration
     def test_real_example(self):
         """ Test a real world example query and analysis """
-        query = """
-        query($org: String!, $number: Int!) {
-            organization(login: $org) {
-                projectV2(number: $number) {
-                items(last: 100) {
-                    nodes {
-                    id
-
-                    fieldValues(first: 8) {
-                        nodes {
-                        ... on ProjectV2ItemFieldSingleSelectValue {
-                            name
-                            field {
-                            ... on ProjectV2FieldCommon {
-                                name
-                            }
-                            }
-                        }
-                        ... on ProjectV2ItemFieldTextValue {
-                            text
-                            field {
-                            ... on ProjectV2FieldCommon {
-                                name
-                            }
-                            }
-                        }
-                        ... on ProjectV2ItemFieldPullRequestValue {
-                            pullRequests(last: 10) {
-                            nodes {
-                                url
-                                number
-                            }
-                            }
-                        }
-                        }
-                    }
+        result = self.batched_result(1)
+        nodes = _get_nodes(result)
+        milestone_numbers = [_get_milestone_number(node) for node in nodes]
+        self.assertEqual(milestone_numbers, [1,2,3])
 
-                    content {
-                        ...on Issue {
-                        title
-                        number
-                        url
-                        state
-                        milestone {
-                            number
-                        }
-                        }
-                    }
-                    }
-                }
-                }
-            }
-        }
-        """
-        with ghgql.GithubGraphQL(token=self.api_token) as ghapi:
-            result = ghapi.query(query=query, variables={"org": "kwk-org", "number": 1})
-            nodes = fnc.get("data.organization.projectV2.items.nodes", result)
-            milestone_numbers = fnc.map("content.milestone.number", nodes)
-            self.assertEqual(list(milestone_numbers), [1,2,3])
-
-            # Get the milestone using the iterator protocol (as requested in #5)
-            i = 1
-            for node in nodes:
-                self.assertEqual(i, fnc.get("content.milestone.number", node))
-                i+=1
+        # Get the milestone using the iterator protocol (as requested in #5)
+        i = 1
+        for node in nodes:
+            self.assertEqual(i, _get_milestone_number(node))
+            i+=1
+
+    @unittest.skipIf(ghgql.ghgql.ijson is None, "ijson is not installed")
+    @use_cassette
+    def test_real_example_stream(self):
+        """ Test that the nodes of the real world example can be streamed """
+        nodes = self.ghapi.query_stream(_REAL_EXAMPLE_QUERY, {"org": "kwk-org", "number": 1},
+                                        path="data.organization.projectV2.items.nodes.item",
+                                        raise_on_error=True)
+        self.assertEqual([_get_milestone_number(node) for node in nodes], [1,2,3])
+
+
+class TestRequests(unittest.TestCase):
+    """ Testcases for how the GithubGraphQL class talks to the endpoint. """
+
+    def test_payload(self):
+        """ Test that the query and variables are sent as a JSON payload. """
+        with mock.patch.object(requests.Session, "post",
+                               side_effect=lambda **_: fake_response({"data": {}})) as post:
+            with ghgql.GithubGraphQL() as ghapi:
+                self.assertEqual(ghapi.session_headers["Content-Type"], "application/json")
+                ghapi.query(query="query($n: Int!) { viewer { login } }", variables={"n": 1})
+            self.assertEqual(json.loads(post.call_args.kwargs["data"]),
+                             {"query": "query($n: Int!) { viewer { login } }", "variables": {"n": 1}})
+
+    def test_payload_non_finite_floats(self):
+        """ Test that NaN and infinite floats are rejected with and without orjson. """
+        for json_module in (ghgql.ghgql.orjson, None):
+            for variables in ({"n": math.nan}, {"n": [1.0, {"m": -math.inf}]}):
+                with self.subTest(json_module=json_module, variables=variables), \
+                     mock.patch("ghgql.ghgql.orjson", json_module), \
+                     mock.patch.object(requests.Session, "post") as post:
+                    with ghgql.GithubGraphQL() as ghapi:
+                        with self.assertRaises(ValueError):
+                            ghapi.query(query="query { viewer { login } }", variables=variables)
+                        with self.assertRaises(ValueError):
+                            ghapi.compile("query { viewer { login } }")(variables)
+                    post.assert_not_called()
+
+    def test_payload_without_orjson(self):
+        """ Test that the payload and the response are handled by json when orjson is missing. """
+        payload = {"data": {"viewer": {"login": "kwk", "name": "K\u00e4"}}}
+        with mock.patch("ghgql.ghgql.orjson", None), \
+             mock.patch.object(requests.Session, "post", return_value=fake_response(payload)) as post:
+            with ghgql.GithubGraphQL() as ghapi:
+                self.assertEqual(ghapi.query(query="query($n: Int!) { viewer { login } }", variables={"n": 1}),
+                                 payload)
+                with self.assertRaises(ValueError):
+                    ghapi.query(query="query { viewer { login } }", variables={"n": math.nan})
+        self.assertEqual(json.loads(post.call_args.kwargs["data"]),
+                         {"query": "query($n: Int!) { viewer { login } }", "variables": {"n": 1}})
+
+    def test_compiled_query(self):
+        """ Test that a compiled query sends the same payload as query() does. """
+        query = 'query($n: Int!, $s: String) { viewer { login } } # "\\u00e4"'
+        with mock.patch.object(requests.Session, "post",
+                               side_effect=lambda **_: fake_response({"data": {}})) as post:
+            with ghgql.GithubGraphQL() as ghapi:
+                compiled = ghapi.compile(query)
+                self.assertEqual(compiled.query, query)
+                for variables in ({"n": 1, "s": "ä\""}, None):
+                    with self.subTest(variables=variables):
+                        self.assertEqual(compiled(variables), {"data": {}})
+                        self.assertEqual(json.loads(post.call_args.kwargs["data"]),
+                                         {"query": query, "variables": variables})
+
+    def test_compiled_query_with_raise_on_error(self):
+        """ Test that a compiled query raises errors like query() does. """
+        res = {"errors": [{"message": "Field 'MADEUPFIELD' doesn't exist on type 'User'"}]}
+        with mock.patch.object(requests.Session, "post", return_value=fake_response(res)):
+            with ghgql.GithubGraphQL() as ghapi:
+                compiled = ghapi.compile("query { viewer { MADEUPFIELD } }")
+                self.assertEqual(compiled(), res)
+                with self.assertRaises(RuntimeError) as ex:
+                    compiled(raise_on_error=True)
+        self.assertEqual(str(ex.exception), res["errors"][0]["message"])
+
+    def test_environment_resolved_once(self):
+        """ Test that proxies are taken from the environment when the client is created. """
+        environ = {"HTTPS_PROXY": "http://proxy.example.com:3128", "NO_PROXY": "", "no_proxy": ""}
+        with mock.patch.dict(os.environ, environ):
+            ghapi = ghgql.GithubGraphQL()
+        with mock.patch.object(requests.Session, "send", return_value=fake_response({"data": {}})) as send, \
+             mock.patch("requests.sessions.get_netrc_auth") as get_netrc_auth:
+            ghapi.query(query="query { viewer { login } }")
+        self.assertEqual(send.call_args.kwargs["proxies"]["https"], "http://proxy.example.com:3128")
+        self.assertEqual(send.call_args.args[0].headers["Authorization"], "Bearer ")
+        get_netrc_auth.assert_not_called()
+
+    @unittest.skipIf(ghgql.ghgql.ijson is None, "ijson is not installed")
+    def test_query_stream(self):
+        """ Test that the values at the given path are yielded one by one. """
+        nodes = [{"title": f"Issue {i}", "score": i / 2} for i in range(10000)]
+        payload = {"data": {"repository": {"issues": {"nodes": nodes}}}}
+        with local_endpoint((200, payload)) as endpoint, ghgql.GithubGraphQL(endpoint=endpoint) as ghapi:
+            issues = ghapi.query_stream("query { repository { issues { nodes { title } } } }",
+                                        path="data.repository.issues.nodes.item")
+            self.assertEqual(list(issues), nodes)
+
+    @unittest.skipIf(ghgql.ghgql.ijson is None, "ijson is not installed")
+    def test_query_stream_with_raise_on_error(self):
+        """ Test that errors are raised once all values were yielded. """
+        payload = {"data": {"viewer": None}, "errors": [{"message": "Not found"}]}
+        with local_endpoint((200, payload), (200, payload)) as endpoint, \
+             ghgql.GithubGraphQL(endpoint=endpoint) as ghapi:
+            self.assertEqual(list(ghapi.query_stream("query { viewer { login } }", path="data.viewer")), [None])
+            with self.assertRaises(RuntimeError) as ex:
+                list(ghapi.query_stream("query { viewer { login } }", raise_on_error=True))
+        self.assertEqual(str(ex.exception), "Not found")
+
+    @unittest.skipIf(ghgql.ghgql.ijson is None, "ijson is not installed")
+    def test_query_stream_empty_chunks(self):
+        """ Test that empty chunks in a response don't end the parsing early. """
+        res = fake_response({})
+        res.raw = mock.Mock()
+        res.iter_content = lambda **_: iter([b'{"data": {"viewer"', b"", b': {"login": "kwk"}}}', b""])
+        with mock.patch.object(requests.Session, "post", return_value=res), ghgql.GithubGraphQL() as ghapi:
+            self.assertEqual(list(ghapi.query_stream("query { viewer { login } }", path="data.viewer.login")),
+                             ["kwk"])
+
+    def test_query_stream_without_ijson(self):
+        """ Test that a missing ijson is reported. """
+        with mock.patch("ghgql.ghgql.ijson", None), ghgql.GithubGraphQL() as ghapi:
+            with self.assertRaises(ImportError):
+                list(ghapi.query_stream("query { viewer { login } }"))
+
+    def test_non_json_response(self):
+        """ Test that a response that isn't JSON raises the same error as requests does. """
+        res = requests.Response()
+        res.status_code = 200
+        res._content = b"<html></html>" # pylint: disable=protected-access
+        for json_module in (ghgql.ghgql.orjson, None):
+            with self.subTest(json_module=json_module), mock.patch("ghgql.ghgql.orjson", json_module), \
+                 mock.patch.object(requests.Session, "post", return_value=res):
+                with ghgql.GithubGraphQL() as ghapi:
+                    with self.assertRaises(requests.JSONDecodeError):
+                        ghapi.query(query="query { viewer { login } }")
+
+    def test_timeout(self):
+        """ Test that every request is sent with the configured timeout. """
+        with mock.patch.object(requests.Session, "post",
+                               side_effect=lambda **_: fake_response({"data": {}})) as post:
+            with ghgql.GithubGraphQL() as ghapi:
+                ghapi.query(query="query { viewer { login } }")
+            self.assertEqual(post.call_args.kwargs["timeout"], (10.0, 60.0))
+            with ghgql.GithubGraphQL(timeout=3) as ghapi:
+                ghapi.query(query="query { viewer { login } }")
+            self.assertEqual(post.call_args.kwargs["timeout"], 3)
+
+    def test_retry_on_server_error(self):
+        """ Test that requests failing with a transient server error are retried. """
+        with local_endpoint((502, {}), (200, {"data": {}})) as endpoint:
+            with ghgql.GithubGraphQL(endpoint=endpoint) as ghapi:
+                self.assertEqual(ghapi.query(query="query { viewer { login } }"), {"data": {}})
+
+    def test_retry_disabled(self):
+        """ Test that the server error is raised when retries are turned off. """
+        with local_endpoint((502, {})) as endpoint:
+            with ghgql.GithubGraphQL(endpoint=endpoint, retries=0) as ghapi:
+                with self.assertRaises(requests.HTTPError):
+                    ghapi.query(query="query { viewer { login } }")
+
+    def test_query_after_close(self):
+        """ Test that a closed client can still send queries and mutations. """
+        with local_endpoint((200, {"data": {}}), (200, {"data": {}})) as endpoint:
+            ghapi = ghgql.GithubGraphQL(endpoint=endpoint)
+            ghapi.close()
+            self.assertEqual(ghapi.query(query="query { viewer { login } }"), {"data": {}})
+            mutation = "mutation { addStar(input: {starrableId: \"foo\"}) { clientMutationId } }"
+            self.assertEqual(ghapi.query(query=mutation), {"data": {}})
+
+    def test_mutation_not_retried(self):
+        """ Test that a mutation is sent exactly once, even if it fails with a transient error. """
+        with local_endpoint((502, {}), (200, {"data": {}})) as endpoint:
+            with ghgql.GithubGraphQL(endpoint=endpoint) as ghapi:
+                with self.assertRaises(requests.HTTPError):
+                    ghapi.query(query="mutation { addStar(input: {starrableId: \"foo\"}) { clientMutationId } }")
+                # The response meant for a retry is still pending
+                self.assertEqual(ghapi.query(query="query { viewer { login } }"), {"data": {}})
+
+    def test_connections_are_shared(self):
+        """ Test that instances reuse the connections opened by earlier instances. """
+        def client_port(client_address):
+            return {"data": {"port": client_address[1]}}
+
+        with local_endpoint((200, client_port), (200, client_port)) as endpoint:
+            with ghgql.GithubGraphQL(endpoint=endpoint) as ghapi:
+                first = ghapi.query(query="query { viewer { login } }")
+            with ghgql.GithubGraphQL(endpoint=endpoint) as ghapi:
+                second = ghapi.query(query="query { viewer { login } }")
+        self.assertEqual(first, second)
+
+
+class TestQueryCache(unittest.TestCase):
+    """ Testcases for caching queries and their results in the GithubGraphQL class. """
+
+    def test_query_file_changed(self):
+        """ Test that a query file is read again after it was changed. """
+        with mock.patch.object(requests.Session, "post",
+                               side_effect=lambda **_: fake_response({"data": {}})) as post:
+            with ghgql.GithubGraphQL() as ghapi, NamedTemporaryFile(mode="w+", encoding="utf-8") as file_handle:
+                file_handle.write("query { viewer { login } }")
+                file_handle.flush()
+                ghapi.query_from_file(file_handle.name)
+                ghapi.query_from_file(file_handle.name)
+                file_handle.seek(0)
+                file_handle.truncate()
+                file_handle.write("query { viewer { name } }")
+                file_handle.flush()
+                ghapi.query_from_file(file_handle.name)
+            queries = [json.loads(call.kwargs["data"])["query"] for call in post.call_args_list]
+            self.assertEqual(queries, ["query { viewer { login } }"] * 2 + ["query { viewer { name } }"])
+
+    def test_cache_disabled_by_default(self):
+        """ Test that identical queries hit the endpoint when no cache_ttl is given. """
+        with mock.patch.object(requests.Session, "post",
+                               side_effect=lambda **_: fake_response({"data": {}})) as post:
+            with ghgql.GithubGraphQL() as ghapi:
+                ghapi.query(query="query { viewer { login } }")
+                ghapi.query(query="query { viewer { login } }")
+            self.assertEqual(post.call_count, 2)
+
+    def test_cache_ttl(self):
+        """ Test that identical queries are answered from the cache. """
+        with mock.patch.object(requests.Session, "post",
+                               side_effect=lambda **_: fake_response({"data": {}})) as post:
+            with ghgql.GithubGraphQL(cache_ttl=60) as ghapi:
+                first = ghapi.query(query="query { viewer { login } }", variables={"a": 1, "b": 2})
+                second = ghapi.query(query="query { viewer { login } }", variables={"b": 2, "a": 1})
+                self.assertIs(first, second)
+                self.assertEqual(post.call_count, 1)
+
+                ghapi.query(query="query { viewer { login } }", variables={"a": 2, "b": 2})
+                self.assertEqual(post.call_count, 2)
+
+                ghapi.invalidate(query="query { viewer { login } }", variables={"a": 1, "b": 2})
+                ghapi.query(query="query { viewer { login } }", variables={"a": 1, "b": 2})
+                self.assertEqual(post.call_count, 3)
+
+                ghapi.clear_cache()
+                ghapi.query(query="query { viewer { login } }", variables={"a": 2, "b": 2})
+                self.assertEqual(post.call_count, 4)
+
+    def test_cache_ttl_expired(self):
+        """ Test that expired cache entries are not used. """
+        with mock.patch.object(requests.Session, "post",
+                               side_effect=lambda **_: fake_response({"data": {}})) as post:
+            with ghgql.GithubGraphQL(cache_ttl=60) as ghapi:
+                with mock.patch("time.monotonic", return_value=1000.0):
+                    ghapi.query(query="query { viewer { login } }")
+                with mock.patch("time.monotonic", return_value=1060.0):
+                    ghapi.query(query="query { viewer { login } }")
+            self.assertEqual(post.call_count, 2)
+
+    def test_cache_compiled_query(self):
+        """ Test that a compiled query shares the cache with query(). """
+        with mock.patch.object(requests.Session, "post",
+                               side_effect=lambda **_: fake_response({"data": {}})) as post:
+            with ghgql.GithubGraphQL(cache_ttl=60) as ghapi:
+                ghapi.query(query="query { viewer { login } }", variables={"a": 1})
+                ghapi.compile("query { viewer { login } }")({"a": 1})
+            self.assertEqual(post.call_count, 1)
+
+    def test_cache_ignores_mutations(self):
+        """ Test that mutations are never answered from the cache. """
+        with mock.patch.object(requests.Session, "post",
+                               side_effect=lambda **_: fake_response({"data": {}})) as post:
+            with ghgql.GithubGraphQL(cache_ttl=60) as ghapi:
+                query = "mutation { addStar(input: {starrableId: \"foo\"}) { clientMutationId } }"
+                ghapi.query(query=query)
+                ghapi.query(query=query)
+            self.assertEqual(post.call_count, 2)
+
+    def test_cache_ignores_errors(self):
+        """ Test that results with errors are not cached. """
+        with mock.patch.object(requests.Session, "post",
+                               side_effect=lambda **_: fake_response(_MADEUPFIELD_RESULT)) as post:
+            with ghgql.GithubGraphQL(cache_ttl=60) as ghapi:
+                ghapi.query(query=_MADEUPFIELD_QUERY)
+                ghapi.query(query=_MADEUPFIELD_QUERY)
+            self.assertEqual(post.call_count, 2)
+
+    def test_cache_max_entries(self):
+        """ Test that the least recently stored entry is dropped once the cache is full. """
+        with mock.patch.object(requests.Session, "post",
+                               side_effect=lambda **_: fake_response({"data": {}})) as post, \
+             mock.patch("ghgql.ghgql._CACHE_MAX_ENTRIES", 2):
+            with ghgql.GithubGraphQL(cache_ttl=60) as ghapi:
+                for i in (1, 2, 3, 3, 2, 1):
+                    ghapi.query(query="query { viewer { login } }", variables={"i": i})
+            self.assertEqual(post.call_count, 4)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,32 @@
+""" Tests for ghgql._util """
+
+import unittest
+from ghgql import dotted_get
+
+
+class TestDottedGet(unittest.TestCase):
+    """ Testcases for the dotted_get function. """
+
+    RESULT = {"data": {"viewer": {"login": "kwk", "name": None}},
+              "errors": [{"message": "Something went wrong"}]}
+
+    def test_get(self):
+        """ Test that values are found by their dotted path. """
+        for path, expected in (("data.viewer.login", "kwk"),
+                               ("data.viewer", {"login": "kwk", "name": None}),
+                               ("errors[0].message", "Something went wrong"),
+                               ("errors.0.message", "Something went wrong"),
+                               ("", self.RESULT)):
+            with self.subTest(path=path):
+                self.assertEqual(dotted_get(self.RESULT, path), expected)
+
+    def test_get_missing(self):
+        """ Test that the default is returned for paths that don't exist. """
+        for path in ("data.repository", "data.viewer.login.foo", "data.viewer.name.foo",
+                     "errors[1].message", "errors.message", "data[0]"):
+            with self.subTest(path=path):
+                self.assertIsNone(dotted_get(self.RESULT, path))
+                self.assertEqual(dotted_get(self.RESULT, path, default=[]), [])
+
+if __name__ == '__main__':
+    unittest.main()